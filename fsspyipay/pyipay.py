@@ -1,14 +1,12 @@
 # -*- coding: utf-8 -*-
 import time
-import xml.etree.ElementTree as ET
 from urllib import parse
-from iso4217 import Currency
 
 from .util import Action
 from .util import decrypt_payload as decrypt
 from .util import encrypt_payload as encrypt
-from .util import read_resource_file, sanitize, validate_gw_url
-from .util import check_if_set, LANG_LOOKUP
+from .util import parse_terminal_configuration, read_resource_file, SanitizedStr, ValidatedURL
+from .util import check_if_set, currency_number, LANG_LOOKUP
 
 from .exceptions import InvalidGatewayResponse
 
@@ -65,6 +63,26 @@ class Gateway:
 
     """
 
+    __slots__ = (
+        "lang",
+        "currency",
+        "amount",
+        "password",
+        "key",
+        "_key_bytes",
+        "portal_id",
+        "_pgw_url",
+        "tracking_id",
+        "_udf1",
+        "_udf2",
+        "_udf3",
+        "_udf4",
+        "_udf5",
+        "_response_url",
+        "_error_url",
+        "_payload_cache",
+    )
+
     def __init__(
         self,
         keystore,
@@ -77,16 +95,16 @@ class Gateway:
     ):
 
         self.lang = LANG_LOOKUP.get(lang, 'USA')
-        self.currency = Currency(currency).number
+        self.currency = currency_number(currency)
         self.amount = amount
 
         # Configure the terminal settings
         terminal_configuration = read_resource_file(resource, keystore, alias)
-        root = ET.fromstring(terminal_configuration)
-        terminal = {c.tag: c.text for c in root}
+        terminal = parse_terminal_configuration(terminal_configuration)
 
         self.password = terminal["password"]
         self.key = terminal["resourceKey"]
+        self._key_bytes = self.key.encode("utf-8")
         self.portal_id = terminal["id"]
         self._pgw_url = terminal["webaddress"]
 
@@ -102,127 +120,78 @@ class Gateway:
         self._udf1 = self._udf2 = self._udf3 = self._udf4 = self._udf5 = ""
         self._response_url = None
         self._error_url = None
-
-    def get_udf1(self):
-        return self._udf1
-
-    def set_udf1(self, s):
-        self._udf1 = sanitize(s)
-
-    def get_udf2(self):
-        return self._udf2
-
-    def set_udf2(self, s):
-        self._udf2 = sanitize(s)
-
-    def get_udf3(self):
-        return self._udf3
-
-    def set_udf3(self, s):
-        self._udf3 = sanitize(s)
-
-    def get_udf4(self):
-        return self._udf4
-
-    def set_udf4(self, s):
-        self._udf4 = sanitize(s)
-
-    def get_udf5(self):
-        return self._udf5
-
-    def set_udf5(self, s):
-        self._udf5 = sanitize(s)
-
-    def set_response_url(self, s):
-        self._response_url = validate_gw_url(s)
-
-    def set_error_url(self, s):
-        self._error_url = validate_gw_url(s)
-
-    def get_response_url(self):
-        return self._response_url
-
-    def get_error_url(self):
-        return self._error_url
-
-    udf1 = property(
-        get_udf1, set_udf1, None, "Set and retrieve UDF1, the values are sanitized."
-    )
-    udf2 = property(
-        get_udf2, set_udf2, None, "Set and retrieve UDF2, the values are sanitized."
-    )
-    udf3 = property(
-        get_udf3, set_udf3, None, "Set and retrieve UDF3, the values are sanitized."
-    )
-    udf4 = property(
-        get_udf4, set_udf4, None, "Set and retrieve UDF4, the values are sanitized."
-    )
-    udf5 = property(
-        get_udf5, set_udf5, None, "Set and retrieve UDF5, the values are sanitized."
-    )
-    response_url = property(
-        get_response_url, set_response_url, None, "Set and retrieve the response URL"
-    )
-    error_url = property(
-        get_error_url, set_error_url, None, "Set and retrieve the error URL"
-    )
+        self._payload_cache = None
+
+    udf1 = SanitizedStr("Set and retrieve UDF1, the values are sanitized.")
+    udf2 = SanitizedStr("Set and retrieve UDF2, the values are sanitized.")
+    udf3 = SanitizedStr("Set and retrieve UDF3, the values are sanitized.")
+    udf4 = SanitizedStr("Set and retrieve UDF4, the values are sanitized.")
+    udf5 = SanitizedStr("Set and retrieve UDF5, the values are sanitized.")
+    response_url = ValidatedURL("Set and retrieve the response URL")
+    error_url = ValidatedURL("Set and retrieve the error URL")
+
+    def _purchase_params(self):
+        return {
+            "action": Action.PURCHASE.value,
+            "id": self.portal_id,
+            "password": self.password,
+            "langid": self.lang,
+            "currencycode": self.currency,
+            "trackid": self.tracking_id,
+            "amt": self.amount,
+            "udf1": self._udf1,
+            "udf2": self._udf2,
+            "udf3": self._udf3,
+            "udf4": self._udf4,
+            "udf5": self._udf5,
+            "responseURL": self._response_url,
+            "errorURL": self._error_url,
+        }
+
+    _PARAM_BUILDERS = {Action.PURCHASE: _purchase_params}
 
     def _build_param_dict(self, action):
-        params = []
-        if action == 1:
-            params.extend(
-                [
-                    ("action", action),
-                    ("id", self.portal_id),
-                    ("password", self.password),
-                    ("langid", self.lang),
-                    ("currencycode", self.currency),
-                    ("trackid", self.tracking_id),
-                    ("amt", self.amount),
-                    ("udf1", self.udf1),
-                    ("udf2", self.udf2),
-                    ("udf3", self.udf3),
-                    ("udf4", self.udf4),
-                    ("udf5", self.udf5),
-                    ("responseURL", self.response_url),
-                    ("errorURL", self.error_url),
-                ]
-            )
-
-        return dict(params)
+        builder = self._PARAM_BUILDERS.get(action)
+        if builder is None:
+            return {}
+        return builder(self)
 
     def _build_payload(self, action):
-        params = self._build_param_dict(action.value)
+        params = self._build_param_dict(action)
 
         # filter out empty values, and set `safe` to avoid
         # encoding URLs, which is not supported by the platform.
         d = parse.urlencode({k: v for k, v in params.items() if v}, safe=":/")
 
-        payload = encrypt(d, self.key)
-        return payload.decode("utf-8")
+        # Encryption is the expensive step, so the payload is reused for as
+        # long as the encoded parameters and the key are unchanged
+        cache_key = (d, self._key_bytes)
+        if self._payload_cache is None or self._payload_cache[0] != cache_key:
+            self._payload_cache = (cache_key, encrypt(d, self._key_bytes))
+        return self._payload_cache[1]
 
     def _get_redirect_url(self, action):
-        payload = self._build_payload(action.value)
-        pgw_url = self._pgw_url
-        gw_url = f"{pgw_url}/PaymentHTTP.htm?param=paymentInit&trandata={payload}"
-        gw_url = f"{gw_url}&tranportalId={self.portal_id}&responseURL={self.response_url}&errorURL={self.error_url}"
-        return gw_url
+        payload = self._build_payload(action)
+        return (
+            f"{self._pgw_url}/PaymentHTTP.htm?param=paymentInit&trandata={payload}"
+            f"&tranportalId={self.portal_id}&responseURL={self.response_url}&errorURL={self.error_url}"
+        )
 
     def _parse_response(self, raw_response):
-        results = parse.parse_qs(raw_response)
-        try:
-            encrypted_payload = results.pop("trandata")
-        except KeyError:
+        results = parse.parse_qsl(raw_response)
+        encrypted_payload = next((v for k, v in results if k == "trandata"), None)
+        if encrypted_payload is None:
             raise InvalidGatewayResponse("Invalid response from the gateway, missing encrypted data")
-        decrypted_results = parse.parse_qs(decrypt(encrypted_payload[0], self.key))
-        return results, decrypted_results
+        decrypted_results = parse.parse_qsl(decrypt(encrypted_payload, self._key_bytes))
+        return [(k, v) for k, v in results if k != "trandata"], decrypted_results
 
     def get_result(self, response):
         common, decrypted = self._parse_response(response)
-        d = {k: v[0] for k, v in common.items()}
-        for k, v in decrypted.items():
-            if k not in d:
-                d[k] = v[0]
+        # the first value wins, and the plain values take precedence
+        # over the decrypted ones
+        d = {}
+        for k, v in common + decrypted:
+            d.setdefault(k, v)
         return d
 
     @check_if_set(['response_url', 'error_url'])
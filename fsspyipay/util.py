@@ -1,20 +1,26 @@
 # -*- coding: utf-8 -*-
-import binascii
 import io
+import os
+import re
 from enum import Enum
-from urllib import parse
 from zipfile import ZipFile
-from functools import wraps
+from functools import lru_cache, wraps
+from operator import attrgetter
 
-import jks
-import pyDes
-from Cryptodome.Cipher import AES
-from Cryptodome.Util import Padding
+# The crypto, keystore and xml libraries are slow to import, so they are
+# imported where they are used rather than when the package is imported.
 
 from .exceptions import InvalidAlias, InvalidUrl, KeyNotFound
 
 PADDING_OFFSET = 16
+DES_BLOCK_SIZE = 8
 FILTER_CHARS = "!#$%^&*()+[]\\';,{}|\":<>?~`"
+_FILTER_TABLE = str.maketrans("", "", FILTER_CHARS)
+_FILTER_BYTES = FILTER_CHARS.encode("ascii")
+TERMINAL_FIELDS = ("password", "resourceKey", "id", "webaddress")
+# Values containing entities or CDATA do not match, and are left to the XML parser
+_TERMINAL_RE = re.compile(rb"<(password|resourceKey|id|webaddress)>([^<&]*)</\1>")
+_XML_ENCODING_RE = re.compile(rb"""^\s*<\?xml[^>]*\bencoding\s*=\s*["']([A-Za-z0-9._-]+)["']""")
 
 
 class Action(Enum):
@@ -26,6 +32,34 @@ class Action(Enum):
 
 LANG_LOOKUP = {'en': 'USA', 'ar': 'ARA'}
 
+# ISO 4217 numeric codes for the currencies commonly used with the gateway,
+# anything else is looked up from the iso4217 package.
+CURRENCY_LOOKUP = {
+    'KWD': 414,
+    'BHD': 48,
+    'SAR': 682,
+    'AED': 784,
+    'OMR': 512,
+    'QAR': 634,
+    'USD': 840,
+    'EUR': 978,
+    'GBP': 826,
+}
+
+
+@lru_cache(maxsize=32)
+def currency_number(code):
+    """Returns the ISO 4217 numeric code for a currency
+
+       :param str code: The ISO currency code, for example 'KWD'
+       :returns: the numeric currency code
+    """
+    try:
+        return CURRENCY_LOOKUP[code]
+    except KeyError:
+        from iso4217 import Currency
+        return Currency(code).number
+
 
 def validate_gw_url(s):
     """The gateway only supports http and https, and response urls cannot have query strings
@@ -33,10 +67,10 @@ def validate_gw_url(s):
        :raises InvalidUrl:
        :returns: the passed in url
     """
-    u = parse.urlparse(s)
-    if u.scheme not in ["http", "https"]:
+    scheme, sep, rest = s.partition("://")
+    if not sep or scheme.lower() not in ("http", "https"):
         raise InvalidUrl("Scheme should be http or https")
-    if u.query:
+    if "?" in rest.partition("#")[0]:
         raise InvalidUrl("URL cannot have a query string")
     return s
 
@@ -46,15 +80,66 @@ def sanitize(text):
        
        :returns: the passed in value, translated by removing `FILTER_CHARS`
     """
-    return text.strip().translate(None, FILTER_CHARS)
+    text = text.strip()
+    # bytes.translate is considerably faster for the common ascii values,
+    # anything else (for example Arabic text) is translated as str
+    try:
+        return text.encode("ascii").translate(None, _FILTER_BYTES).decode("ascii")
+    except UnicodeEncodeError:
+        return text.translate(_FILTER_TABLE)
+
+
+class _CleanedField:
+    """A descriptor which passes values through `clean` before storing them
+       in the matching underscore prefixed attribute of the instance.
+    """
+    clean = None
+
+    def __init__(self, doc=None):
+        self.__doc__ = doc
+
+    def __set_name__(self, owner, name):
+        self.attr = f"_{name}"
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return getattr(instance, self.attr)
+
+    def __set__(self, instance, value):
+        setattr(instance, self.attr, self.clean(value))
+
+
+class SanitizedStr(_CleanedField):
+    """A user defined field (udf), values are sanitized when set"""
+    clean = staticmethod(sanitize)
+
+
+class ValidatedURL(_CleanedField):
+    """A response or error url, values are validated when set
+
+       :raises InvalidUrl:
+    """
+    clean = staticmethod(validate_gw_url)
 
 
 def load_keystore(keystore_path, key_name="pgkey", passphrase="password"):
     """Loads the keystore and extracts the `pgkey` value.
 
+       The key is cached per process, and reloaded if the keystore file changes.
+
        :raises KeyNotFound:
 
     """
+    return _load_keystore(
+        keystore_path, key_name, passphrase, os.path.getmtime(keystore_path)
+    )
+
+
+@lru_cache(maxsize=32)
+def _load_keystore(keystore_path, key_name, passphrase, mtime):
+    import jks
+
     ks = jks.KeyStore.load(keystore_path, passphrase)
     try:
         pk = ks.secret_keys[key_name]
@@ -67,6 +152,9 @@ def read_resource_file(resource_path, keystore_path, alias):
     """Read and returns the terminal configuration from the resource file
        which is a xml string.
 
+       The decrypted configuration is cached per process, and read again
+       if either the resource file or the keystore file changes.
+
        :param str resource_path: A fully qualified file system path to the resource file
        :param str keystore_path: A fully qualified file system path to the keystore file
        :param str alias: The terminal alias which is to be extracted
@@ -76,61 +164,146 @@ def read_resource_file(resource_path, keystore_path, alias):
        :rtype: string
 
     """
-    crypto = pyDes.triple_des(
-        load_keystore(keystore_path), pyDes.ECB, padmode=pyDes.PAD_PKCS5
+    return _read_resource_file(
+        resource_path,
+        keystore_path,
+        alias,
+        os.path.getmtime(resource_path),
+        os.path.getmtime(keystore_path),
     )
+
+
+@lru_cache(maxsize=32)
+def _read_resource_file(resource_path, keystore_path, alias, resource_mtime, keystore_mtime):
+    from Cryptodome.Cipher import DES3
+    from Cryptodome.Util import Padding
+
+    crypto = DES3.new(load_keystore(keystore_path), DES3.MODE_ECB)
     with open(resource_path, "rb") as f:
-        resource_data = crypto.decrypt(f.read())
+        resource_data = Padding.unpad(crypto.decrypt(f.read()), DES_BLOCK_SIZE)
     temp_file = io.BytesIO(
         resource_data
     )  # a "file" that allows data to be open by ZipFile
-    zip_data = ZipFile(temp_file)
-    if f"{alias}.xml" not in zip_data.namelist():
-        raise InvalidAlias(
-            f"The alias {alias} does not exist in the resource file; {zip_data.namelist()}"
-        )
-    zip_contents = crypto.decrypt(zip_data.read(f"{alias}.xml"))
+    with ZipFile(temp_file) as zip_data:
+        try:
+            info = zip_data.getinfo(f"{alias}.xml")
+        except KeyError:
+            raise InvalidAlias(
+                f"The alias {alias} does not exist in the resource file; {zip_data.namelist()}"
+            )
+        with zip_data.open(info) as alias_file:
+            zip_contents = Padding.unpad(
+                crypto.decrypt(alias_file.read()), DES_BLOCK_SIZE
+            )
     return zip_contents
 
 
+def parse_terminal_configuration(terminal_configuration):
+    """Extracts the terminal settings from the xml returned by :func:`read_resource_file`
+
+       The configuration is a flat document, so the known fields are matched
+       directly; the xml parser is used unless each field matches exactly once
+       in a utf-8 document without comments.
+
+       :param bytes terminal_configuration: The terminal configuration xml
+       :returns: a dictionary of the terminal settings
+    """
+    terminal = _match_terminal_fields(terminal_configuration)
+    if terminal is not None:
+        return terminal
+    try:
+        from lxml import etree as ET
+        parser = ET.XMLParser(resolve_entities=False, huge_tree=False)
+    except ImportError:
+        import xml.etree.ElementTree as ET
+        parser = None
+    root = ET.fromstring(terminal_configuration, parser=parser)
+    return {c.tag: c.text for c in root}
+
+
+def _match_terminal_fields(terminal_configuration):
+    """Returns the terminal fields matched by `_TERMINAL_RE`, or None if the
+       match cannot be trusted and the xml parser has to be used instead.
+    """
+    declaration = _XML_ENCODING_RE.match(terminal_configuration)
+    if declaration and declaration.group(1).lower() not in (b"utf-8", b"utf8"):
+        return None
+    # fields inside comments, or nested in other elements, would also match
+    if b"<!--" in terminal_configuration:
+        return None
+    matches = _TERMINAL_RE.findall(terminal_configuration)
+    if len(matches) != len(TERMINAL_FIELDS):
+        return None
+    try:
+        terminal = {k.decode("utf-8"): v.decode("utf-8") for k, v in matches}
+    except UnicodeDecodeError:
+        return None
+    if len(terminal) != len(TERMINAL_FIELDS):
+        return None
+    return terminal
+
+
 def encrypt_payload(plain_text, key):
     """Encrypts and returns cryptext given the plain text and key
     
        :param str plain_text: the plain text to be encrypted
-       :param str key: The key, which is used for AES encryption
+       :param key: The key, which is used for AES encryption
+       :type key: str or bytes
        :return: encrypted text
     """
-    key = key.encode("utf-8")
+    if isinstance(key, str):
+        key = key.encode("utf-8")
+    from Cryptodome.Cipher import AES
+
+    data = plain_text.encode("utf-8")
+    # PKCS#7, inlined since the block size is fixed
+    pad_len = PADDING_OFFSET - len(data) % PADDING_OFFSET
     crypt = AES.new(key, AES.MODE_CBC, iv=key)
-    return binascii.hexlify(
-        crypt.encrypt(Padding.pad(plain_text.encode("utf-8"), PADDING_OFFSET))
-    )
+    return crypt.encrypt(data + bytes((pad_len,)) * pad_len).hex()
 
 
 def decrypt_payload(encrypted_text, key):
     """Decrypts and returns plain text
        
        :param str encrypted_text:
-       :param str key:
+       :param key:
+       :type key: str or bytes
 
        :returns: plain text
     """
-    key = key.encode("utf-8")
-    raw = binascii.unhexlify(encrypted_text)
+    if isinstance(key, str):
+        key = key.encode("utf-8")
+    from Cryptodome.Cipher import AES
+
+    raw = bytes.fromhex(encrypted_text)
     crypt = AES.new(key, AES.MODE_CBC, iv=key)
-    return Padding.unpad(crypt.decrypt(raw), PADDING_OFFSET).decode("utf-8")
+    data = crypt.decrypt(raw)
+    pad_len = data[-1] if data else 0
+    if not 0 < pad_len <= PADDING_OFFSET or data[-pad_len:] != bytes((pad_len,)) * pad_len:
+        raise ValueError("Padding is incorrect.")
+    return data[:-pad_len].decode("utf-8")
 
 
 def check_if_set(props):
     """A decorator that checks if attributes of an instance are set, before a method is called"""
+    # attrgetter returns a bare value for a single attribute, and a tuple otherwise
+    getter = attrgetter(*props)
+    if len(props) == 1:
+        def is_set(instance):
+            return bool(getter(instance))
+    else:
+        def is_set(instance):
+            return all(getter(instance))
+    prop_str = ','.join(props)
+
     def wrapper(f):
+        message = f'{prop_str} must be set before {f.__name__} can be called'
+
         @wraps(f)
         def wrapped(self, *f_args, **f_kwargs):
-            if all(getattr(self, i) for i in props):
-                f(self, *f_args, **f_kwargs)
-            else:
-                prop_str = ','.join(props)
-                raise AttributeError(f'{prop_str} must be set before {f.__name__} can be called')
+            if is_set(self):
+                return f(self, *f_args, **f_kwargs)
+            raise AttributeError(message)
         return wrapped
 
     return wrapper
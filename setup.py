@@ -11,7 +11,7 @@ with open('README.rst') as readme_file:
 with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
-requirements = ['pyDes', 'pyjks', 'iso4217']
+requirements = ['pycryptodomex', 'pyjks', 'iso4217']
 
 setup(
     author="Burhan Khalid",